@@ -0,0 +1,290 @@
+# cython: language_level=3str, boundscheck=False, wraparound=False, cdivision=True
+"""
+This library is free software; you can redistribute it and/or
+modify it under the terms of the IBM Common Public License as
+published by the IBM Corporation; either version 1.0 of the
+License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+IBM Common Public License for more details.
+
+You should have received a copy of the IBM Common Public
+License along with this library
+
+
+Compiled counterpart of CygonRectanglePacker in gimpatlas.py, for atlases
+with thousands of layers. gimpatlas.py combines it with its RectanglePacker
+base class when it can be imported and falls back to its pure Python packer
+otherwise. The plug-in runs in GIMP's Python 2.7, so build it next to
+gimpatlas.py with that interpreter and a Cython release that still supports
+Python 2 (before 3.1):
+
+    python -m pip install "Cython<3.1"
+    python -m Cython.Build.Cythonize -i cygon_packer.pyx
+"""
+
+from libc.stdlib cimport malloc, realloc, free
+from libc.string cimport memmove
+
+cdef class CCygonRectanglePacker:
+    """Packer using a custom algorithm by Markus 'Cygon' Ewald
+
+    Same algorithm and results as CygonRectanglePacker in gimpatlas.py, with
+    the height slices kept in C arrays. Pack() and OutOfSpaceError come from
+    the RectanglePacker base class in gimpatlas.py, which is mixed in there."""
+
+    cdef public int packingAreaWidth
+    cdef public int packingAreaHeight
+
+    # Height silhouette of the rectangles: starting positions and heights of
+    # %sliceCount slices, with room for %capacity slices
+    cdef int *xs
+    cdef int *ys
+    cdef int sliceCount
+    cdef int capacity
+
+    # Height of the lowest slice
+    cdef int minY
+
+    def __cinit__(self, int packingAreaWidth, int packingAreaHeight):
+        """Initializes a new rectangle packer
+
+        packingAreaWidth: Maximum width of the packing area
+        packingAreaHeight: Maximum height of the packing area"""
+        self.packingAreaWidth = packingAreaWidth
+        self.packingAreaHeight = packingAreaHeight
+
+        self.capacity = 64
+        self.xs = <int *>malloc(self.capacity * sizeof(int))
+        self.ys = <int *>malloc(self.capacity * sizeof(int))
+        if self.xs == NULL or self.ys == NULL:
+            raise MemoryError()
+
+        # At the beginning, the packing area is a single slice of height 0
+        self.xs[0] = 0
+        self.ys[0] = 0
+        self.sliceCount = 1
+        self.minY = 0
+
+    def __dealloc__(self):
+        free(self.xs)
+        free(self.ys)
+
+    def TryPack(self, int rectangleWidth, int rectangleHeight):
+        """Tries to allocate space for a rectangle in the packing area
+
+        rectangleWidth: Width of the rectangle to allocate
+        rectangleHeight: Height of the rectangle to allocate
+
+        Returns an (x, y) tuple if space for the rectangle could be allocated
+        be found, otherwise returns None"""
+        cdef int x, y
+
+        # If the rectangle is larger than the packing area in any dimension,
+        # it will never fit!
+        if rectangleWidth > self.packingAreaWidth or rectangleHeight > \
+        self.packingAreaHeight:
+            return None
+
+        # Even the lowest slice is too high for the rectangle, so there is no
+        # need to search for a placement.
+        if self.minY + rectangleHeight >= self.packingAreaHeight:
+            return None
+
+        # Determine the placement for the new rectangle
+        if not self.tryFindBestPlacement(rectangleWidth, rectangleHeight, &x, &y):
+            return None
+
+        # A place for the rectangle was found, update the height slice table
+        # to mark the region of the rectangle as being taken.
+        self.integrateRectangle(x, rectangleWidth, y + rectangleHeight)
+        return (x, y)
+
+    cdef bint tryFindBestPlacement(self, int rectangleWidth,
+                                   int rectangleHeight, int *x, int *y):
+        """Finds the best position for a rectangle of the given dimensions
+
+        Stores the position in %x and %y and returns True if a valid placement
+        for the rectangle could be found, otherwise returns False"""
+        cdef int *xs = self.xs
+        cdef int *ys = self.ys
+        cdef int sliceCount = self.sliceCount
+        cdef int bestSliceIndex = -1 # Slice index where the best placement was found
+        cdef int bestSliceY = 0 # Y position of the best placement found
+        cdef long long bestScore = <long long>self.packingAreaWidth * \
+        self.packingAreaHeight # lower == better!
+        cdef int leftSliceIndex = 0
+        cdef int rightSliceIndex, rightRectangleEnd, rightSliceStart
+        cdef int highest, index
+
+        # Determine the slice in which the right end of the rectangle is located
+        rightSliceIndex = searchSlice(xs, rectangleWidth, 0, sliceCount)
+
+        while rightSliceIndex <= sliceCount:
+            # Determine the highest slice within the slices covered by the
+            # rectangle at its current placement, unless the first slice
+            # alone already rules out beating the best placement so far.
+            highest = ys[leftSliceIndex]
+            if highest < bestScore:
+                for index in range(leftSliceIndex + 1, rightSliceIndex):
+                    if ys[index] > highest:
+                        highest = ys[index]
+
+                # Only process this position if it doesn't leave the packing area
+                if highest + rectangleHeight < self.packingAreaHeight and \
+                highest < bestScore:
+                    bestSliceIndex = leftSliceIndex
+                    bestSliceY = highest
+                    bestScore = highest
+
+                    # Nothing can be placed lower than the lowest slice
+                    if highest == self.minY:
+                        break
+
+            # Advance the starting slice to the next slice start
+            leftSliceIndex += 1
+            if leftSliceIndex >= sliceCount:
+                break
+
+            # Advance the ending slice until we're on the proper slice again,
+            # given the new starting position of the rectangle.
+            rightRectangleEnd = xs[leftSliceIndex] + rectangleWidth
+            while rightSliceIndex <= sliceCount:
+                if rightSliceIndex == sliceCount:
+                    rightSliceStart = self.packingAreaWidth
+                else:
+                    rightSliceStart = xs[rightSliceIndex]
+
+                # Is this the slice we're looking for?
+                if rightSliceStart > rightRectangleEnd:
+                    break
+
+                rightSliceIndex += 1
+
+            # If we crossed the end of the slice array, the rectangle's right
+            # end has left the packing area, and thus, our search ends.
+            if rightSliceIndex > sliceCount:
+                break
+
+        if bestSliceIndex == -1:
+            return False
+        x[0] = xs[bestSliceIndex]
+        y[0] = bestSliceY
+        return True
+
+    cdef int integrateRectangle(self, int left, int width, int bottom) except -1:
+        """Integrates a new rectangle into the height slice table
+
+        left: Position of the rectangle's left side
+        width: Width of the rectangle
+        bottom: Position of the rectangle's lower side"""
+        cdef int startSlice, endSlice, firstSliceOriginalHeight, returnHeight
+        cdef int index
+        cdef int right = left + width
+
+        # Find the first slice that is touched by the rectangle
+        startSlice = searchSlice(self.xs, left, 0, self.sliceCount)
+
+        # Did we score a direct hit on an existing slice start?
+        if startSlice < self.sliceCount and self.xs[startSlice] == left:
+            # We scored a direct hit, so we can replace the slice we have hit
+            firstSliceOriginalHeight = self.ys[startSlice]
+            self.ys[startSlice] = bottom
+        else: # No direct hit, slice starts inside another slice
+            # Add a new slice after the slice in which we start
+            firstSliceOriginalHeight = self.ys[startSlice - 1]
+            self.insertSlice(startSlice, left, bottom)
+
+        startSlice += 1
+
+        # Special case, the rectangle started on the last slice, so we cannot
+        # use the start slice + 1 for the binary search and the possibly
+        # already modified start slice height now only remains in our temporary
+        # firstSliceOriginalHeight variable
+        if startSlice >= self.sliceCount:
+            # If the slice ends within the last slice (usual case, unless it
+            # has the exact same width the packing area has), add another slice
+            # to return to the original height at the end of the rectangle.
+            if right < self.packingAreaWidth:
+                self.insertSlice(self.sliceCount, right, firstSliceOriginalHeight)
+        else: # The rectangle doesn't start on the last slice
+            # The last slice starts at the rightmost edge the silhouette has
+            # reached so far. A rectangle ending beyond it covers all the
+            # remaining slices, without the need for searching.
+            if right > self.xs[self.sliceCount - 1]:
+                endSlice = self.sliceCount
+            else:
+                endSlice = searchSlice(self.xs, right, startSlice, self.sliceCount)
+
+            # Another direct hit on the final slice's end?
+            if endSlice < self.sliceCount and self.xs[endSlice] == right:
+                self.removeSlices(startSlice, endSlice)
+            else: # No direct hit, rectangle ends inside another slice
+                # Find out to which height we need to return at the right end of
+                # the rectangle
+                if endSlice == startSlice:
+                    returnHeight = firstSliceOriginalHeight
+                else:
+                    returnHeight = self.ys[endSlice - 1]
+
+                # Remove all slices covered by the rectangle and begin a new
+                # slice at its end to return back to the height of the slice on
+                # which the rectangle ends.
+                self.removeSlices(startSlice, endSlice)
+                if right < self.packingAreaWidth:
+                    self.insertSlice(startSlice, right, returnHeight)
+
+        # Slices were raised or removed, so the lowest one may have changed
+        self.minY = self.ys[0]
+        for index in range(1, self.sliceCount):
+            if self.ys[index] < self.minY:
+                self.minY = self.ys[index]
+        return 0
+
+    cdef int insertSlice(self, int index, int x, int y) except -1:
+        """Inserts a slice before %index, growing the arrays if needed"""
+        cdef int *xs
+        cdef int *ys
+        if self.sliceCount == self.capacity:
+            xs = <int *>realloc(self.xs, 2 * self.capacity * sizeof(int))
+            if xs == NULL:
+                raise MemoryError()
+            self.xs = xs
+            ys = <int *>realloc(self.ys, 2 * self.capacity * sizeof(int))
+            if ys == NULL:
+                raise MemoryError()
+            self.ys = ys
+            self.capacity *= 2
+
+        memmove(self.xs + index + 1, self.xs + index,
+                (self.sliceCount - index) * sizeof(int))
+        memmove(self.ys + index + 1, self.ys + index,
+                (self.sliceCount - index) * sizeof(int))
+        self.xs[index] = x
+        self.ys[index] = y
+        self.sliceCount += 1
+        return 0
+
+    cdef void removeSlices(self, int start, int end):
+        """Removes the slices from %start up to, but not including, %end"""
+        if end <= start:
+            return
+        memmove(self.xs + start, self.xs + end,
+                (self.sliceCount - end) * sizeof(int))
+        memmove(self.ys + start, self.ys + end,
+                (self.sliceCount - end) * sizeof(int))
+        self.sliceCount -= end - start
+
+cdef inline int searchSlice(int *xs, int x, int lo, int hi):
+    """Returns the index of the first slice in [%lo, %hi) starting at or after
+    %x, like bisect_left()"""
+    cdef int mid
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if xs[mid] < x:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
@@ -24,18 +24,101 @@ http://projectdrake.net/blog/2008/12/29/bin-packing-rectangle-packing-and-image-
 Copyright (c) of the edited part is held by Shigekazu Fukui
 """
 
+from array import array
 from bisect import bisect_left
  
 class OutOfSpaceError(Exception): pass
  
-class Point(object):
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
+def _find_best_placement(xs, ys, packingAreaWidth, packingAreaHeight,
+                         rectangleWidth, rectangleHeight, lowestSliceY):
+    """Finds the best slice for a rectangle of the given dimensions
+ 
+    This is the search loop of CygonRectanglePacker, kept apart from the
+    class so that it only touches local variables.
+ 
+    xs: Starting positions of the height slices
+    ys: Heights of the height slices
+    packingAreaWidth: Maximum width of the packing area
+    packingAreaHeight: Maximum height of the packing area
+    rectangleWidth: Width of the rectangle to find a position for
+    rectangleHeight: Height of the rectangle to find a position for
+    lowestSliceY: Height of the lowest slice, no placement can beat it
+ 
+    Returns a (slice index, Y position) tuple if a valid placement for the
+    rectangle could be found, otherwise returns None"""
+    # Slice index, vertical position and score of the best placement we
+    # could find
+    bestSliceIndex = None # Slice index where the best placement was found
+    bestSliceY = 0 # Y position of the best placement found
+    bestScore = packingAreaWidth * packingAreaHeight # lower == better!
+    sliceCount = len(xs)
+ 
+    # This is the counter for the currently checked position. The search
+    # works by skipping from slice to slice, determining the suitability
+    # of the location for the placement of the rectangle.
+    leftSliceIndex = 0
+ 
+    # Determine the slice in which the right end of the rectangle is located
+    rightSliceIndex = bisect_left(xs, rectangleWidth)
+ 
+    while rightSliceIndex <= sliceCount:
+        # Determine the highest slice within the slices covered by the
+        # rectangle at its current placement. We cannot put the rectangle
+        # any lower than this without overlapping the other rectangles.
+        # The first slice alone already bounds the result from below, so
+        # the window only needs to be scanned if it could beat the best
+        # placement found so far.
+        highest = ys[leftSliceIndex]
+        if highest < bestScore:
+            if rightSliceIndex > leftSliceIndex + 1:
+                highest = max(ys[leftSliceIndex:rightSliceIndex])
+ 
+            # Only process this position if it doesn't leave the packing area
+            if highest + rectangleHeight < packingAreaHeight:
+                score = highest
+ 
+                if score < bestScore:
+                    bestSliceIndex = leftSliceIndex
+                    bestSliceY = highest
+                    bestScore = score
  
-    def __cmp__(self, other):
-        """Compares the starting position of height slices"""
-        return self.x - other.x
+                    # Nothing can be placed lower than the lowest slice
+                    if score == lowestSliceY:
+                        break
+ 
+        # Advance the starting slice to the next slice start
+        leftSliceIndex += 1
+        if leftSliceIndex >= sliceCount:
+            break
+ 
+        # Advance the ending slice until we're on the proper slice again,
+        # given the new starting position of the rectangle.
+        rightRectangleEnd = xs[leftSliceIndex] + rectangleWidth
+        while rightSliceIndex <= sliceCount:
+            if rightSliceIndex == sliceCount:
+                rightSliceStart = packingAreaWidth
+            else:
+                rightSliceStart = xs[rightSliceIndex]
+ 
+            # Is this the slice we're looking for?
+            if rightSliceStart > rightRectangleEnd:
+                break
+ 
+            rightSliceIndex += 1
+ 
+        # If we crossed the end of the slice array, the rectangle's right
+        # end has left the packing area, and thus, our search ends.
+        if rightSliceIndex > sliceCount:
+            break
+ 
+    # Return the best placement we found for this rectangle. If the
+    # rectangle didn't fit anywhere, the slice index will still have its
+    # initialization value of %None and we can report that no placement
+    # could be found.
+    if bestSliceIndex == None:
+        return None
+    else:
+        return (bestSliceIndex, bestSliceY)
  
 class RectanglePacker(object):
     """Base class for rectangle packing algorithms
@@ -76,7 +159,7 @@ http://www.csc.liv.ac.uk/~epa/surveyhtml.html"""
         rectangleWidth: Width of the rectangle to allocate
         rectangleHeight: Height of the rectangle to allocate
  
-        Returns a Point instance if space for the rectangle could be allocated
+        Returns an (x, y) tuple if space for the rectangle could be allocated
         be found, otherwise returns None"""
         raise NotImplementedError
  
@@ -104,11 +187,21 @@ class CygonRectanglePacker(RectanglePacker):
         packingAreaHeight: Maximum height of the packing area"""
         RectanglePacker.__init__(self, packingAreaWidth, packingAreaHeight)
  
-        # Stores the height silhouette of the rectangles
-        self.heightSlices = []
+        # Stores the height silhouette of the rectangles as two parallel
+        # arrays: the starting positions of the slices and their heights.
+        # Coordinates never reach the size of the packing area, so 16-bit
+        # integers are enough for all but huge packing areas.
+        if max(packingAreaWidth, packingAreaHeight) <= 0x8000:
+            typecode = 'h'
+        else:
+            typecode = 'i'
  
         # At the beginning, the packing area is a single slice of height 0
-        self.heightSlices.append(Point(0,0))
+        self._xs = array(typecode, [0])
+        self._ys = array(typecode, [0])
+ 
+        # Height of the lowest slice
+        self._min_y = 0
  
     def TryPack(self, rectangleWidth, rectangleHeight):
         """Tries to allocate space for a rectangle in the packing area
@@ -116,7 +209,7 @@ class CygonRectanglePacker(RectanglePacker):
         rectangleWidth: Width of the rectangle to allocate
         rectangleHeight: Height of the rectangle to allocate
  
-        Returns a Point instance if space for the rectangle could be allocated
+        Returns an (x, y) tuple if space for the rectangle could be allocated
         be found, otherwise returns None"""
         placement = None
  
@@ -126,13 +219,18 @@ class CygonRectanglePacker(RectanglePacker):
         self.packingAreaHeight:
             return None
  
+        # Even the lowest slice is too high for the rectangle, so there is no
+        # need to search for a placement.
+        if self._min_y + rectangleHeight >= self.packingAreaHeight:
+            return None
+ 
         # Determine the placement for the new rectangle
         placement = self.tryFindBestPlacement(rectangleWidth, rectangleHeight)
  
         # If a place for the rectangle could be found, update the height slice
         # table to mark the region of the rectangle as being taken.
         if placement:
-            self.integrateRectangle(placement.x, rectangleWidth, placement.y \
+            self.integrateRectangle(placement[0], rectangleWidth, placement[1] \
             + rectangleHeight)
  
         return placement
@@ -143,73 +241,17 @@ class CygonRectanglePacker(RectanglePacker):
         rectangleWidth: Width of the rectangle to find a position for
         rectangleHeight: Height of the rectangle to find a position for
  
-        Returns a Point instance if a valid placement for the rectangle could
+        Returns an (x, y) tuple if a valid placement for the rectangle could
         be found, otherwise returns None"""
-        # Slice index, vertical position and score of the best placement we
-        # could find
-        bestSliceIndex = None # Slice index where the best placement was found
-        bestSliceY = 0 # Y position of the best placement found
-        bestScore = self.packingAreaWidth * self.packingAreaHeight # lower == better!
- 
-        # This is the counter for the currently checked position. The search
-        # works by skipping from slice to slice, determining the suitability
-        # of the location for the placement of the rectangle.
-        leftSliceIndex = 0
- 
-        # Determine the slice in which the right end of the rectangle is located
-        rightSliceIndex = bisect_left(self.heightSlices, Point(rectangleWidth, 0))
- 
-        while rightSliceIndex <= len(self.heightSlices):
-            # Determine the highest slice within the slices covered by the
-            # rectangle at its current placement. We cannot put the rectangle
-            # any lower than this without overlapping the other rectangles.
-            highest = self.heightSlices[leftSliceIndex].y
-            for index in range(leftSliceIndex + 1, rightSliceIndex):
-                if self.heightSlices[index].y > highest:
-                    highest = self.heightSlices[index].y
- 
-            # Only process this position if it doesn't leave the packing area
-            if highest + rectangleHeight < self.packingAreaHeight:
-                score = highest
- 
-                if score < bestScore:
-                    bestSliceIndex = leftSliceIndex
-                    bestSliceY = highest
-                    bestScore = score
- 
-            # Advance the starting slice to the next slice start
-            leftSliceIndex += 1
-            if leftSliceIndex >= len(self.heightSlices):
-                break
- 
-            # Advance the ending slice until we're on the proper slice again,
-            # given the new starting position of the rectangle.
-            rightRectangleEnd = self.heightSlices[leftSliceIndex].x + rectangleWidth
-            while rightSliceIndex <= len(self.heightSlices):
-                if rightSliceIndex == len(self.heightSlices):
-                    rightSliceStart = self.packingAreaWidth
-                else:
-                    rightSliceStart = self.heightSlices[rightSliceIndex].x
- 
-                # Is this the slice we're looking for?
-                if rightSliceStart > rightRectangleEnd:
-                    break
- 
-                rightSliceIndex += 1
- 
-            # If we crossed the end of the slice array, the rectangle's right
-            # end has left the packing area, and thus, our search ends.
-            if rightSliceIndex > len(self.heightSlices):
-                break
- 
-        # Return the best placement we found for this rectangle. If the
-        # rectangle didn't fit anywhere, the slice index will still have its
-        # initialization value of %None and we can report that no placement
-        # could be found.
-        if bestSliceIndex == None:
+        placement = _find_best_placement(self._xs, self._ys,
+                                         self.packingAreaWidth,
+                                         self.packingAreaHeight,
+                                         rectangleWidth, rectangleHeight,
+                                         self._min_y)
+        if placement is None:
             return None
         else:
-            return Point(self.heightSlices[bestSliceIndex].x, bestSliceY)
+            return (self._xs[placement[0]], placement[1])
  
     def integrateRectangle(self, left, width, bottom):
         """Integrates a new rectangle into the height slice table
@@ -217,18 +259,23 @@ class CygonRectanglePacker(RectanglePacker):
         left: Position of the rectangle's left side
         width: Width of the rectangle
         bottom: Position of the rectangle's lower side"""
+        xs = self._xs
+        ys = self._ys
+        packingAreaWidth = self.packingAreaWidth
+ 
         # Find the first slice that is touched by the rectangle
-        startSlice,hit = binary_search(self.heightSlices, Point(left, 0))
+        startSlice,hit = binary_search(xs, left)
  
         # Did we score a direct hit on an existing slice start?
         if hit:
             # We scored a direct hit, so we can replace the slice we have hit
-            firstSliceOriginalHeight = self.heightSlices[startSlice].y
-            self.heightSlices[startSlice] = Point(left, bottom)
+            firstSliceOriginalHeight = ys[startSlice]
+            ys[startSlice] = bottom
         else: # No direct hit, slice starts inside another slice
             # Add a new slice after the slice in which we start
-            firstSliceOriginalHeight = self.heightSlices[startSlice - 1].y
-            self.heightSlices.insert(startSlice, Point(left, bottom))
+            firstSliceOriginalHeight = ys[startSlice - 1]
+            xs.insert(startSlice, left)
+            ys.insert(startSlice, bottom)
  
         right = left + width
         startSlice += 1
@@ -237,33 +284,46 @@ class CygonRectanglePacker(RectanglePacker):
         # use the start slice + 1 for the binary search and the possibly
         # already modified start slice height now only remains in our temporary
         # firstSliceOriginalHeight variable
-        if startSlice >= len(self.heightSlices):
+        sliceCount = len(xs)
+        if startSlice >= sliceCount:
             # If the slice ends within the last slice (usual case, unless it
             # has the exact same width the packing area has), add another slice
             # to return to the original height at the end of the rectangle.
-            if right < self.packingAreaWidth:
-                self.heightSlices.append(Point(right, firstSliceOriginalHeight))
+            if right < packingAreaWidth:
+                xs.append(right)
+                ys.append(firstSliceOriginalHeight)
         else: # The rectangle doesn't start on the last slice
-            endSlice,hit = binary_search(self.heightSlices, Point(right,0), \
-            startSlice, len(self.heightSlices))
+            # The last slice starts at the rightmost edge the silhouette has
+            # reached so far. A rectangle ending beyond it covers all the
+            # remaining slices, without the need for searching.
+            if right > xs[sliceCount - 1]:
+                endSlice,hit = sliceCount, False
+            else:
+                endSlice,hit = binary_search(xs, right, startSlice, sliceCount)
  
             # Another direct hit on the final slice's end?
             if hit:
-                del self.heightSlices[startSlice:endSlice]
+                del xs[startSlice:endSlice]
+                del ys[startSlice:endSlice]
             else: # No direct hit, rectangle ends inside another slice
                 # Find out to which height we need to return at the right end of
                 # the rectangle
                 if endSlice == startSlice:
                     returnHeight = firstSliceOriginalHeight
                 else:
-                    returnHeight = self.heightSlices[endSlice - 1].y
+                    returnHeight = ys[endSlice - 1]
  
                 # Remove all slices covered by the rectangle and begin a new
                 # slice at its end to return back to the height of the slice on
                 # which the rectangle ends.
-                del self.heightSlices[startSlice:endSlice]
-                if right < self.packingAreaWidth:
-                    self.heightSlices.insert(startSlice, Point(right, returnHeight))
+                del xs[startSlice:endSlice]
+                del ys[startSlice:endSlice]
+                if right < packingAreaWidth:
+                    xs.insert(startSlice, right)
+                    ys.insert(startSlice, returnHeight)
+ 
+        # Slices were raised or removed, so the lowest one may have changed
+        self._min_y = min(ys)
 #endregion
 
 #region MIT license
@@ -299,7 +359,23 @@ from os import getcwd
 from os.path import join, splitext
 from gimpfu import *
 
+# Use the compiled packer if cygon_packer.pyx has been built next to this file,
+# otherwise the pure Python one above.
+try:
+    from cygon_packer import CCygonRectanglePacker
+except ImportError:
+    AtlasPacker = CygonRectanglePacker
+else:
+    class AtlasPacker(CCygonRectanglePacker, RectanglePacker):
+        """Compiled CygonRectanglePacker
+
+        Pack() and the OutOfSpaceError it raises come from RectanglePacker,
+        just like for the pure Python packer."""
+        pass
+
 class TextureRect(object):
+    __slots__ = ('x', 'y', 'width', 'height', 'name')
+    
     def __init__(self, x, y, width, height, name):
         self.x = x
         self.y = y
@@ -319,11 +395,8 @@ class TextureRect(object):
     
     # Casual string representation
     def __str__(self):
-        res = ("{x} {y} {w} {h} \"{name}\"".
-               format(x = self.x, y = self.y, w = self.width, h = self.height,
-                      name = self.name)
-               )
-        return res
+        return "%d %d %d %d \"%s\"" % (self.x, self.y, self.width, self.height,
+                                      self.name)
  
 '''
 TODO: "trim" (trimming blank rim) is not implemented.
@@ -351,7 +424,7 @@ def generate_atlas_and_map(timg, tdrawable,
     tmp_img = pdb.gimp_image_duplicate(timg)
     
     # Prepare a rectangle packer.
-    rect_packer = CygonRectanglePacker(img_w, img_h)
+    rect_packer = AtlasPacker(img_w, img_h)
     
     #
     # Determine the packing position of textures (layers).
@@ -360,9 +433,18 @@ def generate_atlas_and_map(timg, tdrawable,
     # Initialize progress bar.
     pdb.gimp_progress_init("Progress", None)
     
-    layer_len = len(tmp_img.layers)
+    # Pack textures largest-first (by their longer side). The silhouette of
+    # the packer stays simpler this way, which both speeds up the search and
+    # packs more densely than the order of layers in the image.
+    layers = sorted(tmp_img.layers, key = lambda l: max(l.width, l.height),
+                    reverse = True)
+    layer_len = len(layers)
+    # Layer names are needed as unicode for the map file and error messages.
+    names = [l.name.decode("utf_8") for l in layers]
     tex_rects = []
-    for layer,i in zip(tmp_img.layers, range(layer_len)):
+    # Last percentage shown in the progress bar
+    last_pct = -1
+    for i,layer in enumerate(layers):
         # if the texture is invisible but was requested to be included into
         # the texture atlas, make it visible.
         #
@@ -377,18 +459,27 @@ def generate_atlas_and_map(timg, tdrawable,
             pos = rect_packer.TryPack(layer.width + pad, layer.height + pad)
             if pos:
                 # Yay, one layer down! Rectangle packing succeeded.
+                x,y = pos
                 
                 # Update progress bar (how many textures were processed?)
-                pdb.gimp_progress_update(float(i)/layer_len)
+                # Redrawing it is costly, so only do it when the shown
+                # percentage actually changes.
+                pct = 100*i // layer_len
+                if pct != last_pct:
+                    pdb.gimp_progress_update(float(i)/layer_len)
+                    last_pct = pct
                 
                 # Register packing position, texture size, and texture name.
-                tex_rects.append(TextureRect(pos.x, pos.y,
+                tex_rects.append(TextureRect(x, y,
                                              layer.width, layer.height,
-                                             layer.name.decode("utf_8") ))
+                                             names[i]))
                 
-                # Move the texture to its packing position.
+                # Move the texture to its packing position, unless it's
+                # already there (translating still redraws the whole layer).
                 offx,offy = layer.offsets
-                pdb.gimp_layer_translate(layer, pos.x - offx, pos.y - offy)
+                dx,dy = x - offx, y - offy
+                if dx or dy:
+                    pdb.gimp_layer_translate(layer, dx, dy)
             else:
                 # Ouch, this layer is tough! Rectangle packing failed.
                 
@@ -398,7 +489,7 @@ def generate_atlas_and_map(timg, tdrawable,
                 pdb.gimp_message("Error: failed to pack layer \"%s\" into "
                                  "the texture atlas, process aborted.\n"
                                  "Possible cause: the layer is too big to fit." %
-                                 layer.name.decode("utf_8") );
+                                 names[i]);
                 # Abort 
                 return
     # Merge textures into a texture atlas (visible layers into a single layer).
@@ -410,10 +501,13 @@ def generate_atlas_and_map(timg, tdrawable,
         # Trimming is requested.
         crop_w = nearest_pow2(tmp_drawable.width) if pow2 else tmp_drawable.width
         crop_h = nearest_pow2(tmp_drawable.height) if pow2 else tmp_drawable.height
-        pdb.gimp_image_resize(tmp_img, crop_w, crop_h, 0, 0)
     else:
         # No dynamic trimming of the image, just accepting the initially determined size.
-        pdb.gimp_image_resize(tmp_img, img_w, img_h, 0, 0)
+        crop_w, crop_h = img_w, img_h
+    # Resizing reallocates the whole image, so skip it if the working image
+    # already has the requested size.
+    if crop_w != tmp_img.width or crop_h != tmp_img.height:
+        pdb.gimp_image_resize(tmp_img, crop_w, crop_h, 0, 0)
     # The size of the image was finally determined. Reflect it to the size of layer.
     pdb.gimp_layer_resize_to_image_size(tmp_drawable)
     
@@ -428,9 +522,9 @@ def generate_atlas_and_map(timg, tdrawable,
     # Generate a map file
     # TODO: sort by rectangle position
     with open(output_map, "w") as f:
-        for rect in tex_rects:
-            # See TextureRect.__str__ for string representation of TextureRect.
-            f.write(str(rect) + "\n")
+        # See TextureRect.__str__ for string representation of TextureRect.
+        # The whole map is built up front and written at once.
+        f.write("".join(str(rect) + "\n" for rect in tex_rects))
         f.flush()
     
     # Generate a texture atlas image
@@ -441,16 +535,11 @@ def generate_atlas_and_map(timg, tdrawable,
 # Calculate the nearest power-of-2 (including itself)
 # http://en.wikipedia.org/wiki/Power_of_two
 def nearest_pow2(n):
-    m = n & (n-1)
     # It's already pow2. Simply returns it.
-    if not m:
+    if not n & (n-1):
         return n
-    n = m
-    m = n & (n-1)
-    while m:
-        n = m
-        m = n & (n-1)
-    return n << 1
+    # Otherwise, the next pow2 above the highest set bit.
+    return 1 << n.bit_length()
 
 def binary_search(a, x, lo = 0, hi = None):
     # %hi defaults to %len(a)